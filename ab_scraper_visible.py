@@ -2,27 +2,37 @@
 """
 ab_scraper_visible.py
 
-AmbitionBox scraper configured for networks that block headless browsers.
-Uses VISIBLE browser mode (non-headless) which works on most networks.
+AmbitionBox scraper configured for networks that block automated browsers.
+Captures cookies with a stealth headless browser by default; pass --visible
+to fall back to VISIBLE browser mode (non-headless) on stricter networks.
 
-Browser windows will briefly appear and auto-close - this is normal!
+In visible mode browser windows will briefly appear and auto-close - this is normal!
 """
 
 import argparse
 import asyncio
+import atexit
 import csv
+import gzip
 import json
+import os
 import random
+import re
 import time
 import sys
 import logging
+import logging.handlers
+import queue
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from urllib.parse import urlsplit
 from typing import Optional, Tuple, List, Dict
 from datetime import datetime
+from functools import lru_cache
 
 import aiofiles
-import aiohttp
-import requests
+import httpx
+import orjson
 from playwright.async_api import async_playwright
 
 # ----------------- Configuration -----------------
@@ -37,30 +47,91 @@ HEADERS_BASE = {
 SEO_META_ENDPOINT = "https://www.ambitionbox.com/servicegateway-ambitionbox/review-services/v0/seo/{urlname}/meta-data"
 DATA_ENDPOINT = "https://www.ambitionbox.com/servicegateway-ambitionbox/review-services/v0/review/data/{company_id}"
 
+URL_PATTERN = re.compile(r'(https?://[^\s,]+)')
+# Bytes dropped from a lowercased company name when building its slug (keeps a-z, 0-9, '-')
+SLUG_DROP_BYTES = bytes(sorted(set(range(256)) - set(b"abcdefghijklmnopqrstuvwxyz0123456789-")))
+FILENAME_DROP = re.compile(r'[^\w\s-]')
+FILENAME_SEPARATORS = re.compile(r'[-\s]+')
+
 BASE_DIR = Path("reviews_data")
 BATCH_CHECKPOINT = Path("batch_progress.json")
+BATCH_PROGRESS_LOG = Path("batch_progress.ndjson")
 ERROR_LOG = Path("scraper_errors.log")
 PROGRESS_LOG = Path("scraper_progress.log")
+COOKIE_CACHE = Path("cookies_cache.json")
 
 DEFAULT_CONCURRENCY = 5
+DEFAULT_COMPANY_CONCURRENCY = 3
 DEFAULT_LIMIT = 20
 DEFAULT_BATCH_SIZE = 10
 DEFAULT_DELAY_RANGE = (5, 10)
+OUTPUT_COMPRESSLEVEL = 4
 RETRIES = 5
 BACKOFF_BASE = 2.0
+MAX_BACKOFF = 60
 MAX_PROBE_PAGES = 10000
 BROWSER_TIMEOUT = 45000
+COOKIE_TTL = 3600
+BROWSER_RESTART_EVERY = 25
 
-# Logging setup
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(ERROR_LOG),
-        logging.StreamHandler(sys.stdout)
-    ]
-)
+BROWSER_ARGS = [
+    "--disable-blink-features=AutomationControlled",
+    "--no-sandbox",
+    "--disable-dev-shm-usage",
+]
+HEADLESS_ARGS = ["--headless=new", "--disable-gpu"]
+BROWSER_EXTRA_HEADERS = {
+    "sec-ch-ua": '"Chromium";v="120", "Not:A-Brand";v="24"',
+}
+# Hide the automation flag that headless Chromium exposes to page scripts
+STEALTH_INIT_SCRIPT = "Object.defineProperty(navigator,'webdriver',{get:()=>undefined})"
+# Cookie capture only needs the bot-gate cookie, not the rendered page
+BLOCKED_RESOURCE_TYPES = ("image", "media", "font", "stylesheet")
+
+# Logging setup: records are queued and written by a background thread,
+# so logging from async tasks never blocks the event loop on disk writes.
 logger = logging.getLogger(__name__)
+progress_logger = logging.getLogger(f"{__name__}.progress")
+
+def _is_progress(record: logging.LogRecord) -> bool:
+    return record.name == progress_logger.name
+
+def _is_not_progress(record: logging.LogRecord) -> bool:
+    return record.name != progress_logger.name
+
+_error_file_handler = logging.FileHandler(ERROR_LOG)
+_error_file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+_error_file_handler.addFilter(_is_not_progress)
+
+_progress_file_handler = logging.FileHandler(PROGRESS_LOG, encoding="utf-8")
+_progress_file_handler.setFormatter(logging.Formatter('[%(asctime)s] %(message)s', datefmt="%Y-%m-%d %H:%M:%S"))
+_progress_file_handler.addFilter(_is_progress)
+
+_console_handler = logging.StreamHandler(sys.stdout)
+_console_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+_console_handler.addFilter(_is_not_progress)
+
+_progress_console_handler = logging.StreamHandler(sys.stdout)
+_progress_console_handler.addFilter(_is_progress)
+
+_log_queue = queue.Queue(-1)
+logging.getLogger().setLevel(logging.INFO)
+# httpx/httpcore log every request at INFO; keep only their warnings
+logging.getLogger("httpx").setLevel(logging.WARNING)
+logging.getLogger("httpcore").setLevel(logging.WARNING)
+logging.getLogger().addHandler(logging.handlers.QueueHandler(_log_queue))
+_log_listener = logging.handlers.QueueListener(
+    _log_queue,
+    _error_file_handler,
+    _progress_file_handler,
+    _console_handler,
+    _progress_console_handler
+)
+_log_listener.start()
+atexit.register(_log_listener.stop)
+
+# host -> time until which new requests should hold off after a 429/5xx
+_throttled_until: Dict[str, float] = {}
 
 # ----------------- Utilities -----------------
 def ensure_scheme(s: str) -> str:
@@ -68,6 +139,7 @@ def ensure_scheme(s: str) -> str:
         return "https://" + s
     return s
 
+@lru_cache(maxsize=4096)
 def extract_urlname_from_url(url: str) -> Optional[str]:
     try:
         url = url.rstrip("/")
@@ -80,124 +152,295 @@ def extract_urlname_from_url(url: str) -> Optional[str]:
         logger.error(f"Failed to extract urlname from {url}: {e}")
         return None
 
+@lru_cache(maxsize=4096)
 def sanitize_filename(name: str) -> str:
-    import re
-    safe = re.sub(r'[^\w\s-]', '', name).strip()
-    safe = re.sub(r'[-\s]+', '_', safe)
-    return safe[:100]
+    return FILENAME_SEPARATORS.sub('_', FILENAME_DROP.sub('', name).strip())[:100]
 
 def load_batch_progress() -> Dict:
+    """Load the last snapshot, then replay results logged after it was taken."""
+    progress = {"processed": [], "failed": [], "last_index": -1}
     if BATCH_CHECKPOINT.exists():
         try:
-            return json.loads(BATCH_CHECKPOINT.read_text(encoding="utf-8"))
+            progress = orjson.loads(BATCH_CHECKPOINT.read_bytes())
         except Exception as e:
             logger.error(f"Failed to load batch progress: {e}")
-            return {"processed": [], "failed": [], "last_index": -1}
-    return {"processed": [], "failed": [], "last_index": -1}
+    
+    if BATCH_PROGRESS_LOG.exists():
+        seen = {r["index"] for r in progress["processed"] + progress["failed"]}
+        try:
+            for line in BATCH_PROGRESS_LOG.read_bytes().splitlines():
+                try:
+                    result = orjson.loads(line)
+                except orjson.JSONDecodeError:
+                    continue  # partial line from an interrupted write
+                if result["index"] in seen:
+                    continue
+                seen.add(result["index"])
+                progress["processed" if result["success"] else "failed"].append(result)
+            while progress["last_index"] + 1 in seen:
+                progress["last_index"] += 1
+        except Exception as e:
+            logger.error(f"Failed to replay batch progress log: {e}")
+    
+    return progress
 
 def save_batch_progress(progress: Dict):
+    """
+    Write a full snapshot; the append-only log it supersedes is cleared only
+    once the new snapshot has atomically replaced the old one.
+    """
+    tmp = BATCH_CHECKPOINT.with_suffix(".tmp")
     try:
-        BATCH_CHECKPOINT.write_text(json.dumps(progress, indent=2), encoding="utf-8")
+        tmp.write_bytes(orjson.dumps(progress, option=orjson.OPT_INDENT_2))
+        os.replace(tmp, BATCH_CHECKPOINT)
+        BATCH_PROGRESS_LOG.unlink(missing_ok=True)
     except Exception as e:
         logger.error(f"Failed to save batch progress: {e}")
 
-def log_progress(message: str):
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    log_msg = f"[{timestamp}] {message}\n"
+async def append_progress_line(result: Dict):
     try:
-        with open(PROGRESS_LOG, "a", encoding="utf-8") as f:
-            f.write(log_msg)
-    except Exception:
-        pass
-    print(message)
+        async with aiofiles.open(BATCH_PROGRESS_LOG, 'ab') as f:
+            await f.write(orjson.dumps(result) + b"\n")
+    except Exception as e:
+        logger.error(f"Failed to append batch progress: {e}")
+
+# The bot-gate cookie is scoped to the whole ambitionbox.com domain, so one
+# entry serves every company. Loaded from disk once and kept in memory.
+_cookie_cache: Optional[Dict] = None
+
+def load_cookie_cache() -> Dict:
+    global _cookie_cache
+    if _cookie_cache is None:
+        _cookie_cache = {}
+        if COOKIE_CACHE.exists():
+            try:
+                data = json.loads(COOKIE_CACHE.read_text(encoding="utf-8"))
+                # Older caches held one entry per company; start over from those
+                if isinstance(data.get("cookie"), str):
+                    _cookie_cache = data
+            except Exception as e:
+                logger.error(f"Failed to load cookie cache: {e}")
+    return _cookie_cache
+
+def remember_cookie(cookie_str: str):
+    """Store a freshly captured cookie; reuses never extend its TTL."""
+    global _cookie_cache
+    _cookie_cache = {"cookie": cookie_str, "ts": time.time()}
+    tmp = COOKIE_CACHE.with_suffix(".tmp")
+    try:
+        tmp.write_text(json.dumps(_cookie_cache, indent=2), encoding="utf-8")
+        os.replace(tmp, COOKIE_CACHE)
+    except Exception as e:
+        logger.error(f"Failed to save cookie cache: {e}")
+
+def cached_cookie() -> Optional[str]:
+    """The cached domain cookie if it was captured less than COOKIE_TTL ago."""
+    cache = load_cookie_cache()
+    if cache and time.time() - cache.get("ts", 0) < COOKIE_TTL:
+        return cache["cookie"]
+    return None
 
-# ----------------- Cookie Capture (Non-Headless) -----------------
-async def capture_cookies_visible_browser(review_url: str, max_attempts: int = 3) -> Tuple[Optional[str], str]:
+def retry_delay(resp: httpx.Response, attempt: int) -> float:
     """
-    Capture cookies using VISIBLE browser (non-headless mode).
-    Browser window will appear briefly - this is normal!
-    
-    Returns (cookie_string, error_message)
+    Honor the server's Retry-After (in seconds) or fall back to exponential
+    backoff. Capped at MAX_BACKOFF either way, since the delay holds off
+    every request to the host, not just this page.
     """
-    review_url = ensure_scheme(review_url)
-    
-    print("      [Browser window will appear briefly - don't close it manually]")
-    
-    for attempt in range(max_attempts):
-        browser = None
-        try:
-            async with async_playwright() as p:
-                # Launch in NON-HEADLESS mode (visible browser)
-                browser = await p.chromium.launch(
-                    headless=False,  # VISIBLE BROWSER - works on your network!
-                    args=["--no-sandbox", "--disable-dev-shm-usage"]
-                )
-                
-                context = await browser.new_context(
-                    user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+    retry_after = resp.headers.get("Retry-After")
+    if retry_after and retry_after.replace('.', '', 1).isdigit():
+        return min(MAX_BACKOFF, float(retry_after))
+    return min(MAX_BACKOFF, BACKOFF_BASE ** attempt) + random.random() * 0.5
+
+async def wait_if_throttled(host: str):
+    remaining = _throttled_until.get(host, 0) - time.time()
+    if remaining > 0:
+        await asyncio.sleep(remaining)
+
+def log_progress(message: str):
+    progress_logger.info(message)
+
+# ----------------- Cookie Capture -----------------
+async def block_heavy_resources(route):
+    if route.request.resource_type in BLOCKED_RESOURCE_TYPES:
+        await route.abort()
+    else:
+        await route.continue_()
+
+class CookieCapturer:
+    """
+    Captures cookies using a single stealth headless browser, or a VISIBLE
+    browser (non-headless mode) when `headless` is False.
+
+    The browser is launched once per batch and every company gets a fresh,
+    throwaway context. The browser is recycled every `restart_every`
+    captures to keep its memory usage bounded.
+    """
+
+    def __init__(self, restart_every: int = BROWSER_RESTART_EVERY, headless: bool = True):
+        self.restart_every = restart_every
+        self.headless = headless
+        self.browser = None
+        self._pw = None
+        self._captures = 0
+        self._lock = asyncio.Lock()
+
+    async def start(self):
+        self._pw = await async_playwright().start()
+        args = BROWSER_ARGS + (HEADLESS_ARGS if self.headless else [])
+        self.browser = await self._pw.chromium.launch(headless=self.headless, args=args)
+        self._captures = 0
+
+    async def stop(self):
+        if self.browser:
+            try:
+                await self.browser.close()
+            except Exception:
+                pass
+            self.browser = None
+        if self._pw:
+            try:
+                await self._pw.stop()
+            except Exception:
+                pass
+            self._pw = None
+
+    async def restart(self):
+        await self.stop()
+        await self.start()
+
+    async def capture(self, review_url: str, max_attempts: int = 3) -> Tuple[Optional[str], str]:
+        """
+        Capture cookies for a review page in a fresh browser context.
+        In visible mode the browser window will appear briefly - this is normal!
+
+        Captures are serialized so a browser restart never pulls the browser
+        out from under another company.
+
+        Returns (cookie_string, error_message)
+        """
+        async with self._lock:
+            return await self._capture(review_url, max_attempts)
+
+    async def _capture(self, review_url: str, max_attempts: int) -> Tuple[Optional[str], str]:
+        review_url = ensure_scheme(review_url)
+
+        if self.browser is None:
+            log_progress("  → Starting browser...")
+            await self.restart()
+        elif self._captures >= self.restart_every:
+            log_progress("  → Restarting browser...")
+            await self.restart()
+        self._captures += 1
+
+        if not self.headless:
+            log_progress("      [Browser window will appear briefly - don't close it manually]")
+
+        for attempt in range(max_attempts):
+            context = None
+            try:
+                if not self.browser.is_connected():
+                    await self.restart()
+
+                context = await self.browser.new_context(
+                    user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+                    extra_http_headers=BROWSER_EXTRA_HEADERS
                 )
-                
+                await context.add_init_script(STEALTH_INIT_SCRIPT)
+                await context.route("**/*", block_heavy_resources)
+
                 page = await context.new_page()
-                
+
                 # Navigate
-                print(f"      [Opening {review_url}...]")
-                await page.goto(review_url, timeout=BROWSER_TIMEOUT, wait_until="domcontentloaded")
-                
-                # Wait for page to settle
+                log_progress(f"      [Opening {review_url}...]")
+                await page.goto(review_url, timeout=BROWSER_TIMEOUT, wait_until="commit")
+
+                # Give the bot-gate challenge a moment to set its cookie
                 try:
-                    await page.wait_for_load_state("networkidle", timeout=5000)
+                    await page.wait_for_load_state("networkidle", timeout=2000)
                 except Exception:
                     pass
-                
+
                 # Get cookies
                 cookies = await context.cookies()
-                
-                # Close browser
-                await browser.close()
-                print("      [Browser closed automatically]")
-                
+
+                # Close context, the browser stays up for the next company
+                await context.close()
+                context = None
+                log_progress("      [Browser context closed automatically]")
+
                 if cookies and len(cookies) > 0:
                     cookie_str = "; ".join([f"{c['name']}={c['value']}" for c in cookies])
-                    print(f"      ✓ Captured {len(cookies)} cookies")
+                    log_progress(f"      ✓ Captured {len(cookies)} cookies")
                     return cookie_str, ""
                 else:
-                    print(f"      ⚠ No cookies captured, retrying...")
-                    
-        except Exception as e:
-            if browser:
-                try:
-                    await browser.close()
-                except:
-                    pass
-            
-            error_msg = f"Attempt {attempt+1}/{max_attempts} failed: {str(e)}"
-            logger.warning(error_msg)
-            print(f"      ✗ {error_msg}")
-            
-            if attempt < max_attempts - 1:
-                wait_time = 2 ** attempt
-                print(f"      → Waiting {wait_time}s before retry...")
-                await asyncio.sleep(wait_time)
-            else:
-                return None, error_msg
-    
-    return None, "All cookie capture attempts failed"
+                    log_progress(f"      ⚠ No cookies captured, retrying...")
+
+            except Exception as e:
+                if context:
+                    try:
+                        await context.close()
+                    except:
+                        pass
+
+                error_msg = f"Attempt {attempt+1}/{max_attempts} failed: {str(e)}"
+                logger.warning(error_msg)
+                log_progress(f"      ✗ {error_msg}")
+
+                if attempt < max_attempts - 1:
+                    wait_time = 2 ** attempt
+                    log_progress(f"      → Waiting {wait_time}s before retry...")
+                    await asyncio.sleep(wait_time)
+                else:
+                    return None, error_msg
+
+        return None, "All cookie capture attempts failed"
+
+# ----------------- Rate Limiting -----------------
+class TokenBucket:
+    """
+    Shared rate limiter for API requests. Tokens refill at `rate_per_sec`
+    up to `burst`, so idle moments make up for slow ones instead of every
+    page paying a fixed sleep.
+    """
+
+    def __init__(self, rate_per_sec: float, burst: int):
+        self.rate = rate_per_sec
+        self.capacity = burst
+        self.tokens = float(burst)
+        self.last = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
 
 # ----------------- SEO Probe -----------------
-def probe_seo_meta(urlname: str, cookie_str: str, timeout: int = 30) -> Optional[dict]:
+async def probe_seo_meta(client: httpx.AsyncClient, bucket: TokenBucket, urlname: str,
+                         cookie_str: str, timeout: int = 30) -> Optional[dict]:
     headers = dict(HEADERS_BASE)
     headers["cookie"] = cookie_str
     headers["referer"] = f"https://www.ambitionbox.com/reviews/{urlname}-reviews"
     
+    url = SEO_META_ENDPOINT.format(urlname=urlname)
     try:
-        r = requests.get(
-            SEO_META_ENDPOINT.format(urlname=urlname),
+        # Probes share the data requests' back-off window and rate limit
+        await wait_if_throttled(urlsplit(url).hostname)
+        await bucket.acquire()
+        r = await client.get(
+            url,
             headers=headers,
             params={"page": 1},
             timeout=timeout
         )
         r.raise_for_status()
-        return r.json()
+        return orjson.loads(r.content)
     except Exception as e:
         logger.error(f"SEO probe failed for {urlname}: {e}")
         return None
@@ -212,45 +455,52 @@ def extract_company_id(seo_json: dict) -> Optional[int]:
         return None
 
 # ----------------- Page Discovery -----------------
-async def discover_total_pages(company_id: int, urlname: str, cookie_str: str, limit: int) -> int:
+async def discover_total_pages(client: httpx.AsyncClient, bucket: TokenBucket, seo_json: dict,
+                               company_id: int, urlname: str, cookie_str: str, limit: int) -> Tuple[int, Optional[dict]]:
+    """
+    Returns (total_pages, first_page_json). When the data endpoint had to be
+    probed, its page-1 body is handed back so it isn't fetched twice.
+    """
     headers = dict(HEADERS_BASE)
     headers["cookie"] = cookie_str
     headers["referer"] = f"https://www.ambitionbox.com/reviews/{urlname}-reviews"
     
     # Try SEO metadata
     try:
-        seo = probe_seo_meta(urlname, cookie_str)
-        if seo:
-            pagination = (seo.get("data") or {}).get("pagination") or {}
-            total = int(pagination.get("totalPages", 0))
-            if total > 1:
-                return total
+        pagination = (seo_json.get("data") or {}).get("pagination") or {}
+        total = int(pagination.get("totalPages", 0))
+        if total > 1:
+            return total, None
     except Exception:
         pass
     
     # Try data endpoint page 1
     try:
         url = DATA_ENDPOINT.format(company_id=company_id)
-        r = requests.get(
+        await wait_if_throttled(urlsplit(url).hostname)
+        await bucket.acquire()
+        r = await client.get(
             url,
             headers=headers,
             params={"page": 1, "limit": limit, "isReviewRequest": "true"},
             timeout=30
         )
         if r.status_code == 200:
-            pag = (r.json().get("data") or {}).get("pagination") or {}
+            first_page = orjson.loads(r.content)
+            pag = (first_page.get("data") or {}).get("pagination") or {}
             total = int(pag.get("totalPages", 0))
-            if total > 1:
-                return total
+            return max(total, 1), first_page
     except Exception:
         pass
     
-    return 1
+    return 1, None
 
 # ----------------- Async Fetcher -----------------
 class CompanyFetcher:
-    def __init__(self, company_id: int, urlname: str, cookie_str: str, 
-                 out_file: Path, concurrency: int = 5, limit: int = 20):
+    def __init__(self, client: httpx.AsyncClient, bucket: TokenBucket, company_id: int,
+                 urlname: str, cookie_str: str, out_file: Path, concurrency: int = 5, limit: int = 20):
+        self.client = client
+        self.bucket = bucket
         self.company_id = company_id
         self.urlname = urlname
         self.cookie_str = cookie_str
@@ -263,33 +513,36 @@ class CompanyFetcher:
         self.headers["referer"] = f"https://www.ambitionbox.com/reviews/{urlname}-reviews"
         
         self.sem = asyncio.Semaphore(concurrency)
-        self.session: Optional[aiohttp.ClientSession] = None
-    
-    async def __aenter__(self):
-        timeout = aiohttp.ClientTimeout(total=None, sock_connect=10, sock_read=30)
-        self.session = aiohttp.ClientSession(headers=self.headers, timeout=timeout)
-        return self
-    
-    async def __aexit__(self, exc_type, exc, tb):
-        if self.session:
-            await self.session.close()
+        # Pages hand their output to a single writer task (see _write_loop),
+        # so the gzip stream is opened once and lines never interleave.
+        self._queue: Optional[asyncio.Queue] = None
+        self._out_fh = None
+        # GzipFile isn't thread-safe: every write and the final close run on
+        # this one thread, so a close can never overlap an in-flight write
+        # (cancelling the writer task doesn't stop its worker thread).
+        self._io: Optional[ThreadPoolExecutor] = None
     
     async def fetch_page_json(self, page: int):
         url = DATA_ENDPOINT.format(company_id=self.company_id)
+        host = urlsplit(url).hostname
         params = {"page": page, "limit": self.limit, "isReviewRequest": "true"}
         
         for attempt in range(RETRIES):
             try:
                 async with self.sem:
-                    async with self.session.get(url, params=params) as resp:
-                        if resp.status == 200:
-                            return await resp.json(), None
-                        elif resp.status in (429, 503):
-                            backoff = BACKOFF_BASE ** attempt + random.random()
-                            await asyncio.sleep(backoff)
-                            continue
-                        else:
-                            return None, f"status_{resp.status}"
+                    await wait_if_throttled(host)
+                    await self.bucket.acquire()
+                    resp = await self.client.get(url, params=params, headers=self.headers)
+                if resp.status_code == 200:
+                    return orjson.loads(resp.content), None
+                elif resp.status_code == 429 or resp.status_code >= 500:
+                    # Hold off every request to this host, not just this page;
+                    # the retry waits in wait_if_throttled() above.
+                    until = time.time() + retry_delay(resp, attempt)
+                    _throttled_until[host] = max(_throttled_until.get(host, 0), until)
+                    continue
+                else:
+                    return None, f"status_{resp.status_code}"
             except Exception as e:
                 if attempt < RETRIES - 1:
                     backoff = BACKOFF_BASE ** attempt + random.random()
@@ -299,8 +552,9 @@ class CompanyFetcher:
         
         return None, "max_retries_exceeded"
     
-    async def process_page(self, page_num: int) -> Tuple[bool, int]:
-        data, err = await self.fetch_page_json(page_num)
+    async def process_page(self, page_num: int, data: Optional[dict] = None) -> Tuple[bool, int]:
+        if data is None:
+            data, err = await self.fetch_page_json(page_num)
         
         if data is None:
             return False, 0
@@ -310,54 +564,87 @@ class CompanyFetcher:
             if not isinstance(reviews, list):
                 return False, 0
             
-            tmp_file = self.out_file.with_suffix(f'.page{page_num}.tmp')
-            
-            async with aiofiles.open(tmp_file, 'w', encoding='utf-8') as f:
-                for review in reviews:
-                    try:
-                        line = json.dumps({
-                            "urlName": self.urlname,
-                            "company_id": self.company_id,
-                            **review
-                        }, ensure_ascii=False)
-                        await f.write(line + '\n')
-                    except Exception:
-                        pass
-            
-            async with aiofiles.open(self.out_file, 'a', encoding='utf-8') as main_f:
-                async with aiofiles.open(tmp_file, 'r', encoding='utf-8') as tmp_f:
-                    content = await tmp_f.read()
-                    await main_f.write(content)
+            buf = bytearray()
+            for review in reviews:
+                try:
+                    buf += orjson.dumps({
+                        "urlName": self.urlname,
+                        "company_id": self.company_id,
+                        **review
+                    })
+                    buf += b"\n"
+                except Exception:
+                    pass
             
-            tmp_file.unlink(missing_ok=True)
-            await asyncio.sleep(0.05 + random.random() * 0.1)
+            await self._queue.put(buf)
             return True, len(reviews)
             
         except Exception as e:
             logger.error(f"Error processing page {page_num}: {e}")
             return False, 0
     
-    async def run(self, total_pages: int) -> Tuple[int, int]:
+    async def _write_loop(self):
+        while True:
+            buf = await self._queue.get()
+            try:
+                # gzip compression is CPU-bound, keep it off the event loop
+                await asyncio.get_running_loop().run_in_executor(self._io, self._out_fh.write, buf)
+            except Exception as e:
+                logger.error(f"Failed to write reviews for {self.urlname}: {e}")
+            finally:
+                self._queue.task_done()
+    
+    async def run(self, total_pages: int, first_page: Optional[dict] = None) -> Tuple[int, int]:
         self.out_file.parent.mkdir(parents=True, exist_ok=True)
         
         pages_fetched = 0
         reviews_written = 0
         
-        batch_size = 50
-        for start in range(1, total_pages + 1, batch_size):
-            end = min(start + batch_size, total_pages + 1)
-            tasks = [self.process_page(p) for p in range(start, end)]
-            results = await asyncio.gather(*tasks)
+        # Appending a new gzip member keeps resumed runs readable as one stream
+        self._io = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"write-{self.urlname}")
+        self._out_fh = await asyncio.get_running_loop().run_in_executor(
+            self._io, lambda: gzip.open(self.out_file, 'ab', compresslevel=OUTPUT_COMPRESSLEVEL)
+        )
+        self._queue = asyncio.Queue(maxsize=128)
+        writer = asyncio.create_task(self._write_loop())
+        
+        try:
+            batch_size = 50
+            for start in range(1, total_pages + 1, batch_size):
+                end = min(start + batch_size, total_pages + 1)
+                tasks = [
+                    self.process_page(p, first_page if p == 1 else None)
+                    for p in range(start, end)
+                ]
+                results = await asyncio.gather(*tasks)
+                
+                for ok, cnt in results:
+                    if ok:
+                        pages_fetched += 1
+                        reviews_written += cnt
             
-            for ok, cnt in results:
-                if ok:
-                    pages_fetched += 1
-                    reviews_written += cnt
+            await self._queue.join()
+        finally:
+            # The cancelled writer can't submit further writes, so the close
+            # queues behind any write still running and finishes the gzip
+            # member even if this coroutine is cancelled while waiting
+            writer.cancel()
+            closed = self._io.submit(self._out_fh.close)
+            self._io.shutdown(wait=False)
+            await asyncio.gather(writer, return_exceptions=True)
+            await asyncio.wrap_future(closed)
         
         return pages_fetched, reviews_written
 
 # ----------------- Company Processor -----------------
-async def process_company(url: str, index: int, total: int, args) -> Dict:
+async def process_company(url: str, index: int, total: int, args, capturer: CookieCapturer,
+                          client: httpx.AsyncClient, bucket: TokenBucket,
+                          fetch_slots: asyncio.Semaphore) -> Dict:
+    """
+    Cookie capture runs first; the download only starts once one of
+    `fetch_slots` is free, so the next company's cookies can be captured
+    while earlier companies are still downloading.
+    """
     result = {
         "url": url,
         "index": index,
@@ -381,44 +668,60 @@ async def process_company(url: str, index: int, total: int, args) -> Dict:
         
         company_dir = BASE_DIR / f"{sanitize_filename(urlname)}_reviews"
         company_dir.mkdir(parents=True, exist_ok=True)
-        out_file = company_dir / f"reviews_{urlname}.ndjson"
+        out_file = company_dir / f"reviews_{urlname}.ndjson.gz"
         
-        log_progress(f"  → Capturing cookies for {urlname}...")
-        cookie_str, error = await capture_cookies_visible_browser(url)
+        cookie_str, seo_data = None, None
+        cached = cached_cookie()
+        if cached:
+            seo_data = await probe_seo_meta(client, bucket, urlname, cached)
+            if seo_data:
+                cookie_str = cached
+                log_progress(f"  → Reusing cached cookies for {urlname}")
         
         if not cookie_str:
-            raise ValueError(f"Cookie capture failed: {error}")
-        
-        log_progress(f"  → Fetching company metadata...")
-        seo_data = probe_seo_meta(urlname, cookie_str)
-        if not seo_data:
-            raise ValueError("Failed to fetch SEO metadata")
+            log_progress(f"  → Capturing cookies for {urlname}...")
+            cookie_str, error = await capturer.capture(url)
+            
+            if not cookie_str:
+                raise ValueError(f"Cookie capture failed: {error}")
+            
+            log_progress(f"  → Fetching company metadata...")
+            seo_data = await probe_seo_meta(client, bucket, urlname, cookie_str)
+            if not seo_data:
+                raise ValueError("Failed to fetch SEO metadata")
+            
+            remember_cookie(cookie_str)
         
         company_id = extract_company_id(seo_data)
         if not company_id:
             raise ValueError("Could not extract company ID")
         
-        total_pages = await discover_total_pages(company_id, urlname, cookie_str, args.limit)
-        result["pages"] = total_pages
-        
-        log_progress(f"  → Found {total_pages} pages, starting download...")
-        
-        start_time = time.time()
-        async with CompanyFetcher(
-            company_id=company_id,
-            urlname=urlname,
-            cookie_str=cookie_str,
-            out_file=out_file,
-            concurrency=args.concurrency,
-            limit=args.limit
-        ) as fetcher:
-            pages_fetched, reviews_written = await fetcher.run(total_pages)
-        
-        elapsed = time.time() - start_time
-        
-        result["success"] = True
-        result["reviews"] = reviews_written
-        result["output_file"] = str(out_file)
+        async with fetch_slots:
+            total_pages, first_page = await discover_total_pages(
+                client, bucket, seo_data, company_id, urlname, cookie_str, args.limit
+            )
+            result["pages"] = total_pages
+            
+            log_progress(f"  → Found {total_pages} pages, starting download...")
+            
+            start_time = time.time()
+            fetcher = CompanyFetcher(
+                client=client,
+                bucket=bucket,
+                company_id=company_id,
+                urlname=urlname,
+                cookie_str=cookie_str,
+                out_file=out_file,
+                concurrency=args.concurrency,
+                limit=args.limit
+            )
+            pages_fetched, reviews_written = await fetcher.run(total_pages, first_page)
+            
+            elapsed = time.time() - start_time
+            
+            result["success"] = True
+            result["reviews"] = reviews_written
+            result["output_file"] = str(out_file)
         
         log_progress(f"  ✓ Success: {reviews_written} reviews in {elapsed:.1f}s")
         
@@ -430,7 +733,8 @@ async def process_company(url: str, index: int, total: int, args) -> Dict:
     return result
 
 # ----------------- Batch Processor -----------------
-async def process_batch(companies: List[str], args):
+async def process_batch(companies: List[str], args, client: httpx.AsyncClient,
+                        bucket: TokenBucket):
     progress = load_batch_progress()
     start_index = progress["last_index"] + 1 if args.resume else 0
     
@@ -438,8 +742,9 @@ async def process_batch(companies: List[str], args):
     log_progress(f"\nStarting batch processing: {total} companies")
     log_progress(f"Resume from index: {start_index}")
     log_progress(f"Batch size: {args.batch_size}")
-    log_progress(f"Browser mode: VISIBLE (non-headless)")
-    log_progress(f"Delay between companies: {args.min_delay}-{args.max_delay}s")
+    log_progress(f"Browser mode: {'VISIBLE (non-headless)' if args.visible else 'HEADLESS (stealth)'}")
+    log_progress(f"Companies in parallel: {args.company_concurrency}")
+    log_progress(f"Delay before each company: {args.min_delay}-{args.max_delay}s")
     
     stats = {
         "total": total,
@@ -448,48 +753,88 @@ async def process_batch(companies: List[str], args):
         "skipped": 0
     }
     
-    try:
-        for i in range(start_index, total):
-            url = companies[i].strip()
-            
-            if not url:
-                stats["skipped"] += 1
-                continue
-            
-            result = await process_company(url, i, total, args)
-            
+    # The browser launches on the first cache miss, not up front
+    capturer = CookieCapturer(restart_every=args.browser_restart_every, headless=not args.visible)
+    
+    # One company more than --company-concurrency may be in flight: it
+    # captures its cookies while the others download, then waits for a slot.
+    pipeline_slots = asyncio.Semaphore(args.company_concurrency + 1)
+    fetch_slots = asyncio.Semaphore(args.company_concurrency)
+    progress_lock = asyncio.Lock()
+    
+    # Companies complete out of order, so last_index only advances over a
+    # contiguous run of finished indices.
+    if args.resume:
+        done = {r["index"] for r in progress["processed"] + progress["failed"]}
+    else:
+        done = set()
+        progress["last_index"] = start_index - 1
+    
+    async def _worker(i: int, url: str) -> Dict:
+        async with pipeline_slots:
+            delay = random.uniform(args.min_delay, args.max_delay)
+            log_progress(f"  → Waiting {delay:.1f}s before company {i+1}...")
+            await asyncio.sleep(delay)
+            result = await process_company(url, i, total, args, capturer, client, bucket, fetch_slots)
+        
+        async with progress_lock:
             if result["success"]:
                 progress["processed"].append(result)
             else:
                 progress["failed"].append(result)
             
-            progress["last_index"] = i
-            save_batch_progress(progress)
+            done.add(result["index"])
+            while progress["last_index"] + 1 in done:
+                progress["last_index"] += 1
+            await append_progress_line(result)
+        
+        return result
+    
+    tasks = []
+    for i in range(start_index, total):
+        url = companies[i].strip()
+        
+        if not url:
+            stats["skipped"] += 1
+            done.add(i)
+            continue
+        
+        if i in done:
+            continue
+        
+        tasks.append(asyncio.create_task(_worker(i, url)))
+    
+    # Each result is appended to BATCH_PROGRESS_LOG as it lands; the full
+    # snapshot is only rewritten every `snapshot_every` companies.
+    snapshot_every = max(10, total // 100)
+    finished = 0
+    try:
+        for next_result in asyncio.as_completed(tasks):
+            await next_result
+            finished += 1
+            
+            if finished % snapshot_every == 0:
+                # Holding the lock keeps `progress` and the log unchanged
+                # while the snapshot is serialized and written in a thread
+                async with progress_lock:
+                    await asyncio.to_thread(save_batch_progress, progress)
             
             stats["processed"] = len(progress["processed"])
             stats["failed"] = len(progress["failed"])
             
-            if (i + 1) % 10 == 0:
+            if finished % 10 == 0:
                 success_rate = (stats["processed"] / (stats["processed"] + stats["failed"]) * 100) if (stats["processed"] + stats["failed"]) > 0 else 0
-                log_progress(f"\nProgress: {i+1}/{total} | Success: {stats['processed']} | Failed: {stats['failed']} | Rate: {success_rate:.1f}%")
-            
-            if i < total - 1:
-                delay = random.uniform(args.min_delay, args.max_delay)
-                log_progress(f"  → Waiting {delay:.1f}s before next company...")
-                await asyncio.sleep(delay)
-
-            #Batch Delay
-            """
-            if (i + 1) % args.batch_size == 0 and i < total - 1:
-                batch_delay = random.uniform(args.batch_delay_min, args.batch_delay_max)
-                log_progress(f"\n  ⏸ Batch rest: {batch_delay:.1f}s\n")
-                await asyncio.sleep(batch_delay)
-            """
+                log_progress(f"\nProgress: {finished}/{len(tasks)} | Success: {stats['processed']} | Failed: {stats['failed']} | Rate: {success_rate:.1f}%")
     
     except KeyboardInterrupt:
         log_progress("\n⚠ Interrupted by user. Progress saved.")
-        save_batch_progress(progress)
         raise
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        save_batch_progress(progress)
+        await capturer.stop()
     
     log_progress(f"\n{'='*60}")
     log_progress("FINAL SUMMARY")
@@ -505,8 +850,8 @@ def read_companies_from_csv(csv_path: Path, url_column: str = None) -> List[str]
     
     try:
         with open(csv_path, 'r', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            headers = reader.fieldnames or []
+            reader = csv.reader(f)
+            headers = next(reader, None) or []
             
             # Decide which column to use
             if not url_column:
@@ -524,18 +869,17 @@ def read_companies_from_csv(csv_path: Path, url_column: str = None) -> List[str]
                 
                 log_progress(f"Using column '{url_column}' for URLs")
             
-            import re
-            url_pattern = re.compile(r'(https?://[^\s,]+)')
+            col = headers.index(url_column) if url_column in headers else None
             
             for row in reader:
-                if not url_column:
+                if col is None or col >= len(row):
                     continue
-                raw = (row.get(url_column) or "").strip()
+                raw = row[col].strip()
                 if not raw:
                     continue
 
                 # 1) If the cell contains an explicit http/https URL, extract it
-                m = url_pattern.search(raw)
+                m = URL_PATTERN.search(raw)
                 if m:
                     companies.append(m.group(1))
                     continue
@@ -546,9 +890,8 @@ def read_companies_from_csv(csv_path: Path, url_column: str = None) -> List[str]
                     continue
 
                 # 3) Otherwise, treat the value as a company name and build slug
-                name = raw.lower()
-                name = name.replace(" ", "-").replace("_", "-")
-                name = re.sub(r'[^a-z0-9-]', '', name)
+                name = raw.lower().replace(" ", "-").replace("_", "-")
+                name = name.encode("ascii", "ignore").translate(None, SLUG_DROP_BYTES).decode("ascii")
                 url = f"https://www.ambitionbox.com/reviews/{name}-reviews"
                 companies.append(url)
     
@@ -563,7 +906,7 @@ def read_companies_from_csv(csv_path: Path, url_column: str = None) -> List[str]
 # ----------------- CLI -----------------
 def parse_args():
     parser = argparse.ArgumentParser(
-        description="AmbitionBox scraper using VISIBLE browser (works on all networks)"
+        description="AmbitionBox scraper using a stealth headless browser (or --visible fallback)"
     )
     
     parser.add_argument("--csv", required=True, type=Path, help="CSV file with company URLs")
@@ -571,16 +914,29 @@ def parse_args():
     
     parser.add_argument("--concurrency", type=int, default=5, 
                        help="Concurrent requests per company (default: 5)")
+    parser.add_argument("--company-concurrency", type=int, default=DEFAULT_COMPANY_CONCURRENCY,
+                       help=f"Companies processed in parallel (default: {DEFAULT_COMPANY_CONCURRENCY})")
+    parser.add_argument("--total-connections", type=int, default=None,
+                       help="Max HTTP connections (default: max(256, 4 x concurrency x company-concurrency))")
+    parser.add_argument("--keepalive-connections", type=int, default=None,
+                       help="Keep-alive connections held open to the site (default: min(64, 2 x concurrency x company-concurrency))")
+    parser.add_argument("--rate", type=float, default=None,
+                       help="Max API requests (pages and probes) per second across all companies (default: 2 x concurrency x company-concurrency)")
     parser.add_argument("--limit", type=int, default=20,
                        help="Reviews per page (20/50/100, default: 20)")
     
     parser.add_argument("--batch-size", type=int, default=10,
                        help="Companies per batch before long rest (default: 10)")
     parser.add_argument("--delay", type=str, default="5-10",
-                       help="Delay range between companies in seconds (default: 5-10)")
+                       help="Random delay before each company starts, in seconds (default: 5-10)")
     parser.add_argument("--batch-delay", type=str, default="30-60",
                        help="Delay range after each batch in seconds (default: 30-60)")
     
+    parser.add_argument("--visible", action="store_true",
+                       help="Use a VISIBLE (non-headless) browser for cookie capture")
+    parser.add_argument("--browser-restart-every", type=int, default=BROWSER_RESTART_EVERY,
+                       help=f"Restart the browser after this many companies (default: {BROWSER_RESTART_EVERY})")
+    
     parser.add_argument("--resume", action="store_true",
                        help="Resume from last checkpoint")
     parser.add_argument("--reset", action="store_true",
@@ -589,9 +945,27 @@ def parse_args():
     return parser.parse_args()
 
 # ----------------- Main -----------------
-async def main_async():
-    args = parse_args()
-    
+def create_http_client(args) -> httpx.AsyncClient:
+    """
+    Build the single HTTP/2 client shared by every company. Pages from
+    ambitionbox.com are multiplexed over a few kept-alive connections
+    instead of opening one TCP+TLS connection per in-flight request.
+    """
+    total_connections = args.total_connections or max(256, args.concurrency * args.company_concurrency * 4)
+    keepalive_connections = args.keepalive_connections or min(64, args.concurrency * args.company_concurrency * 2)
+    return httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(
+            max_connections=total_connections,
+            max_keepalive_connections=keepalive_connections,
+            keepalive_expiry=30
+        ),
+        timeout=httpx.Timeout(30.0, connect=15.0),
+        # requests/aiohttp followed redirects by default; httpx does not
+        follow_redirects=True
+    )
+
+async def main_async(args):
     # Parse delay ranges
     try:
         min_d, max_d = map(float, args.delay.split('-'))
@@ -608,8 +982,8 @@ async def main_async():
     BASE_DIR.mkdir(exist_ok=True)
     
     if args.reset:
-        if BATCH_CHECKPOINT.exists():
-            BATCH_CHECKPOINT.unlink()
+        BATCH_CHECKPOINT.unlink(missing_ok=True)
+        BATCH_PROGRESS_LOG.unlink(missing_ok=True)
         log_progress("Progress reset. Starting fresh.")
     
     companies = read_companies_from_csv(args.csv, args.url_column)
@@ -618,21 +992,43 @@ async def main_async():
         logger.error("No companies found in CSV")
         return
     
-    await process_batch(companies, args)
+    async with create_http_client(args) as client:
+        rate = args.rate or args.concurrency * args.company_concurrency * 2
+        bucket = TokenBucket(rate_per_sec=rate, burst=args.concurrency)
+        await process_batch(companies, args, client, bucket)
+
+def install_uvloop():
+    """Use uvloop's faster event loop where available (it has no Windows build)."""
+    if sys.platform == "win32":
+        return
+    try:
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    except ImportError:
+        pass
 
 def main():
+    args = parse_args()
+    install_uvloop()
+    
     print("\n" + "="*60)
-    print("AmbitionBox Scraper - VISIBLE Browser Mode")
-    print("="*60)
-    print("\n⚠️  IMPORTANT NOTES:")
-    print("   • Browser windows will appear briefly (3-5 seconds each)")
-    print("   • This is NORMAL - they auto-close after capturing cookies")
-    print("   • Don't manually close the browser windows")
-    print("   • You can minimize them - they'll still work")
+    if args.visible:
+        print("AmbitionBox Scraper - VISIBLE Browser Mode")
+        print("="*60)
+        print("\n⚠️  IMPORTANT NOTES:")
+        print("   • Browser windows will appear briefly (3-5 seconds each)")
+        print("   • This is NORMAL - they auto-close after capturing cookies")
+        print("   • Don't manually close the browser windows")
+        print("   • You can minimize them - they'll still work")
+    else:
+        print("AmbitionBox Scraper - HEADLESS Browser Mode")
+        print("="*60)
+        print("\n   • Cookies are captured with a stealth headless browser")
+        print("   • Re-run with --visible if your network blocks headless mode")
     print("\n" + "="*60 + "\n")
     
     try:
-        asyncio.run(main_async())
+        asyncio.run(main_async(args))
     except KeyboardInterrupt:
         log_progress("\n⚠ Gracefully shutting down...")
     except Exception as e:
@@ -6,86 +6,151 @@ Diagnoses connection issues with AmbitionBox.
 Tests different methods to access the site.
 """
 
+import argparse
 import asyncio
+import json
 import sys
-import requests
+from dataclasses import asdict, dataclass
+from typing import Optional
+import aiodns
+import httpx
 from playwright.async_api import async_playwright
 import ssl
 import socket
 
-def test_dns_resolution():
+UA_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"
+}
+
+# hostname -> IPv4 address found by test_dns_resolution. Only the Chromium
+# launch in test 5 reuses it; the httpx probes in tests 2 and 3 run alongside
+# test 1 and do their own lookup.
+_RESOLVED = {}
+
+# Chromium subsystems a one-shot navigation test never uses
+LEAN_CHROMIUM_ARGS = (
+    "--disable-gpu",
+    "--disable-extensions",
+    "--no-first-run",
+    "--disable-background-networking",
+    "--disable-default-apps",
+    "--disable-sync",
+    "--mute-audio",
+)
+
+# Chromium error marker -> label for a failed navigation, checked in order
+TRIAGE = (
+    ("ERR_HTTP2_PROTOCOL_ERROR", "HTTP2 Protocol Error"),
+    ("ERR_NAME_NOT_RESOLVED", "DNS Resolution Failed"),
+)
+
+@dataclass
+class Result:
+    """Outcome of one diagnostic test, rendered once in the summary."""
+    name: str
+    ok: bool
+    detail: str
+    config: Optional[dict] = None  # working Playwright config, for playwright_ambitionbox
+
+def _emit(log):
+    """Write a test's buffered lines with a single write and flush."""
+    if log:
+        sys.stdout.write("\n".join(log) + "\n")
+        sys.stdout.flush()
+
+def _is_ssl_error(exc):
+    """httpx reports TLS failures as ConnectError; look for the ssl error underneath."""
+    while exc is not None:
+        if isinstance(exc, ssl.SSLError):
+            return True
+        exc = exc.__cause__ or exc.__context__
+    return False
+
+async def test_dns_resolution(log):
     """Test if DNS resolution works."""
-    print("\n1. Testing DNS Resolution...")
+    log.append("\n1. Testing DNS Resolution...")
     try:
-        ip = socket.gethostbyname("www.ambitionbox.com")
-        print(f"   ✓ DNS resolved: www.ambitionbox.com → {ip}")
-        return True
+        # c-ares backed lookup, so the event loop keeps serving the other tests
+        resolver = aiodns.DNSResolver()
+        result = await resolver.gethostbyname("www.ambitionbox.com", socket.AF_INET)
+        ip = result.addresses[0]
+        _RESOLVED["www.ambitionbox.com"] = ip
+        log.append(f"   ✓ DNS resolved: www.ambitionbox.com → {ip}")
+        return Result("dns", True, f"www.ambitionbox.com → {ip}")
     except Exception as e:
-        print(f"   ✗ DNS resolution failed: {e}")
-        return False
+        log.append(f"   ✗ DNS resolution failed: {e}")
+        return Result("dns", False, f"DNS resolution failed: {e}")
 
-def test_basic_connectivity():
+async def test_basic_connectivity(client, log):
     """Test basic HTTP connectivity."""
-    print("\n2. Testing Basic HTTP Connectivity...")
+    log.append("\n2. Testing Basic HTTP Connectivity...")
     try:
-        response = requests.get(
-            "https://www.ambitionbox.com",
-            timeout=10,
-            headers={
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"
-            }
-        )
-        print(f"   ✓ HTTP request successful: Status {response.status_code}")
-        return True
-    except requests.exceptions.SSLError as e:
-        print(f"   ✗ SSL Error: {e}")
-        return False
-    except requests.exceptions.ConnectionError as e:
-        print(f"   ✗ Connection Error: {e}")
-        return False
+        response = await client.get("https://www.ambitionbox.com", timeout=10)
+        log.append(f"   ✓ HTTP request successful: Status {response.status_code} "
+                   f"({response.http_version}, {response.elapsed.total_seconds():.2f}s)")
+        return Result("http", True, f"Status {response.status_code} ({response.http_version})")
+    except httpx.ConnectError as e:
+        detail = f"SSL Error: {e}" if _is_ssl_error(e) else f"Connection Error: {e}"
+        log.append(f"   ✗ {detail}")
+        return Result("http", False, detail)
     except Exception as e:
-        print(f"   ✗ Request failed: {e}")
-        return False
+        log.append(f"   ✗ Request failed: {e}")
+        return Result("http", False, f"Request failed: {e}")
 
-def test_specific_page():
+async def test_specific_page(client, log):
     """Test accessing a specific review page."""
-    print("\n3. Testing Specific Review Page...")
+    log.append("\n3. Testing Specific Review Page...")
     try:
-        response = requests.get(
-            "https://www.ambitionbox.com/reviews/infosys-reviews",
-            timeout=15,
-            headers={
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"
-            }
-        )
-        print(f"   ✓ Review page accessible: Status {response.status_code}")
-        if response.status_code == 200:
-            print(f"   ✓ Content length: {len(response.text)} bytes")
-        return True
+        # Only the size is reported, so count the body as it streams in
+        # rather than buffering it
+        size = None
+        async with client.stream("GET", "https://www.ambitionbox.com/reviews/infosys-reviews") as response:
+            if response.status_code == 200:
+                content_length = response.headers.get("Content-Length")
+                if content_length:
+                    size = int(content_length)
+                else:
+                    # Raw bytes, as Content-Length would count them (still
+                    # compressed if the server used Content-Encoding)
+                    size = 0
+                    async for chunk in response.aiter_raw():
+                        size += len(chunk)
+        log.append(f"   ✓ Review page accessible: Status {response.status_code} "
+                   f"({response.elapsed.total_seconds():.2f}s)")
+        detail = f"Status {response.status_code}"
+        if size is not None:
+            log.append(f"   ✓ Content length: {size} bytes")
+            detail += f", {size} bytes"
+        return Result("page", True, detail)
     except Exception as e:
-        print(f"   ✗ Failed to access review page: {e}")
-        return False
+        log.append(f"   ✗ Failed to access review page: {e}")
+        return Result("page", False, f"Failed to access review page: {e}")
 
-async def test_playwright_basic():
+async def test_playwright_basic(p, log):
     """Test basic Playwright browser launch."""
-    print("\n4. Testing Playwright Browser...")
+    log.append("\n4. Testing Playwright Browser...")
+    if p is None:
+        log.append("   ✗ Playwright driver not available")
+        return Result("playwright_basic", False, "Playwright driver not available")
     try:
-        async with async_playwright() as p:
-            browser = await p.chromium.launch(headless=True)
-            print("   ✓ Browser launched successfully")
-            context = await browser.new_context()
-            print("   ✓ Browser context created")
-            page = await context.new_page()
-            print("   ✓ New page created")
-            await browser.close()
-            return True
+        browser = await p.chromium.launch(headless=True)
+        log.append("   ✓ Browser launched successfully")
+        context = await browser.new_context()
+        log.append("   ✓ Browser context created")
+        page = await context.new_page()
+        log.append("   ✓ New page created")
+        await browser.close()
+        return Result("playwright_basic", True, "Browser, context and page created")
     except Exception as e:
-        print(f"   ✗ Playwright error: {e}")
-        return False
+        log.append(f"   ✗ Playwright error: {e}")
+        return Result("playwright_basic", False, f"Playwright error: {e}")
 
-async def test_playwright_ambitionbox():
+async def test_playwright_ambitionbox(p, log, pin_dns=False):
     """Test Playwright navigation to AmbitionBox."""
-    print("\n5. Testing Playwright Navigation to AmbitionBox...")
+    log.append("\n5. Testing Playwright Navigation to AmbitionBox...")
+    if p is None:
+        log.append("   ✗ Playwright driver not available")
+        return Result("playwright_ambitionbox", False, "Playwright driver not available")
     
     configs = [
         {
@@ -111,147 +176,262 @@ async def test_playwright_ambitionbox():
     ]
     
     for config in configs:
-        print(f"\n   Trying: {config['name']}")
-        try:
-            async with async_playwright() as p:
-                browser = await p.chromium.launch(
+        config["args"].extend(LEAN_CHROMIUM_ARGS)
+    
+    # With --pin-dns, reuse the address from test 1 so Chromium skips its own
+    # DNS lookup. This is a launch-only flag, kept out of the reported config
+    # so nobody copies one CDN IP into their scraper. Off by default: with the
+    # rule in place Chromium never resolves the host itself, so its own DNS
+    # failures (ERR_NAME_NOT_RESOLVED) can't show up, and test 1's c-ares
+    # lookup isn't the system resolver Chromium would use.
+    ip = _RESOLVED.get("www.ambitionbox.com") if pin_dns else None
+    launch_only_args = [f"--host-resolver-rules=MAP www.ambitionbox.com {ip}"] if ip else []
+    pinned = f" (DNS pinned to {ip})" if ip else ""
+    if pinned:
+        log.append(f"   → Chromium DNS pinned to {ip}; its own lookup is not tested")
+    
+    # Configs that share launch options reuse one browser and only get a
+    # fresh context each.
+    browsers = {}
+    launch_locks = {}
+    
+    async def get_browser(p, config):
+        launch_key = (config["headless"], tuple(config["args"]))
+        async with launch_locks.setdefault(launch_key, asyncio.Lock()):
+            if launch_key not in browsers:
+                browsers[launch_key] = await p.chromium.launch(
                     headless=config["headless"],
-                    args=config["args"]
-                )
-                context = await browser.new_context(
-                    user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-                    ignore_https_errors=True
+                    args=config["args"] + launch_only_args
                 )
-                page = await context.new_page()
-                
-                print(f"      → Navigating to AmbitionBox...")
-                response = await page.goto(
-                    "https://www.ambitionbox.com/reviews/infosys-reviews",
-                    timeout=30000,
-                    wait_until="domcontentloaded"
-                )
-                
-                status = response.status if response else "No response"
-                print(f"      ✓ SUCCESS! Status: {status}")
-                print(f"      ✓ Final URL: {page.url}")
-                
-                cookies = await context.cookies()
-                print(f"      ✓ Cookies captured: {len(cookies)}")
-                
-                await browser.close()
-                
-                print(f"\n   ✅ WORKING CONFIG: {config['name']}")
-                return config
-                
+        return browsers[launch_key]
+    
+    async def try_config(p, config, log):
+        log.append(f"\n   Trying: {config['name']}")
+        context = None
+        try:
+            browser = await get_browser(p, config)
+            context = await browser.new_context(
+                user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+                ignore_https_errors=True
+            )
+            page = await context.new_page()
+            
+            log.append(f"      → [{config['name']}] Navigating to AmbitionBox...")
+            response = await page.goto(
+                "https://www.ambitionbox.com/reviews/infosys-reviews",
+                timeout=10000,
+                # Response headers arriving is enough to prove the connection works
+                wait_until="commit"
+            )
+            
+            status = response.status if response else "No response"
+            log.append(f"      ✓ [{config['name']}] SUCCESS! Status: {status}")
+            log.append(f"      ✓ Final URL: {page.url}")
+            
+            cookies = await context.cookies()
+            log.append(f"      ✓ Cookies captured: {len(cookies)}")
+            return config
+            
         except Exception as e:
             error_str = str(e)
-            if "ERR_HTTP2_PROTOCOL_ERROR" in error_str:
-                print(f"      ✗ HTTP2 Protocol Error")
-            elif "ERR_NAME_NOT_RESOLVED" in error_str:
-                print(f"      ✗ DNS Resolution Failed")
-            elif "timeout" in error_str.lower():
-                print(f"      ✗ Timeout")
+            for marker, label in TRIAGE:
+                if marker in error_str:
+                    break
             else:
-                print(f"      ✗ Error: {error_str[:100]}")
-            await asyncio.sleep(0.5)
+                label = "Timeout" if "timeout" in error_str.lower() else f"Error: {error_str[:100]}"
+            log.append(f"      ✗ [{config['name']}] {label}")
+            raise
+        finally:
+            if context:
+                try:
+                    await context.close()
+                except Exception:
+                    pass
     
-    print(f"\n   ✗ All Playwright configs failed")
-    return None
+    # Any working config will do, so try them all at once and keep the
+    # first success (earliest in `configs` if several finish together).
+    # Each config buffers its own lines; they are merged in `configs` order.
+    working_config = None
+    config_logs = [[] for _ in configs]
+    tasks = [asyncio.create_task(try_config(p, config, config_log))
+             for config, config_log in zip(configs, config_logs)]
+    pending = set(tasks)
+    try:
+        while pending and working_config is None:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in tasks:
+                if task in done and task.exception() is None:
+                    working_config = task.result()
+                    break
+    finally:
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for config_log in config_logs:
+            log.extend(config_log)
+        for browser in browsers.values():
+            try:
+                await browser.close()
+            except Exception:
+                pass
 
-async def main():
-    print("="*60)
-    print("AmbitionBox Connection Diagnostic Tool")
-    print("="*60)
+    if working_config:
+        log.append(f"\n   ✅ WORKING CONFIG: {working_config['name']}")
+        return Result("playwright_ambitionbox", True, working_config["name"] + pinned, working_config)
     
-    results = {}
+    log.append(f"\n   ✗ All Playwright configs failed")
+    return Result("playwright_ambitionbox", False, "All Playwright configs failed" + pinned)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Diagnose connection issues with AmbitionBox")
+    parser.add_argument("--json", action="store_true",
+                        help="Print only the test results as JSON (for CI)")
+    parser.add_argument("--pin-dns", action="store_true",
+                        help="Point Chromium at the IP from the DNS test instead of letting it resolve the host")
+    return parser.parse_args()
+
+async def main(args):
+    # In --json mode stdout carries only the JSON document
+    verbose = not args.json
+    if verbose:
+        print("="*60)
+        print("AmbitionBox Connection Diagnostic Tool")
+        print("="*60)
     
-    # Test 1: DNS
-    results['dns'] = test_dns_resolution()
+    # Tests 4 and 5 share one Playwright driver process
+    try:
+        playwright = await async_playwright().start()
+    except Exception as e:
+        if verbose:
+            print(f"\n   ✗ Playwright driver failed to start: {e}")
+        playwright = None
     
-    # Test 2: Basic HTTP
-    results['http'] = test_basic_connectivity()
+    try:
+        # Tests 1-4 are independent, so run them concurrently: DNS, basic HTTP
+        # and specific page (sharing one HTTP/2 connection), Playwright basic.
+        # The client resolves the host on its own, independently of test 1.
+        # Each buffers its output, which is written out in test order below.
+        logs = [[] for _ in range(4)]
+        async with httpx.AsyncClient(http2=True, timeout=15, headers=UA_HEADERS, verify=True,
+                                     follow_redirects=True) as client:
+            outcomes = await asyncio.gather(
+                test_dns_resolution(logs[0]),
+                test_basic_connectivity(client, logs[1]),
+                test_specific_page(client, logs[2]),
+                test_playwright_basic(playwright, logs[3]),
+                return_exceptions=True
+            )
+        results = []
+        for name, outcome, log in zip(('dns', 'http', 'page', 'playwright_basic'), outcomes, logs):
+            if isinstance(outcome, Exception):
+                log.append(f"\n   ✗ {name} test crashed: {outcome}")
+                outcome = Result(name, False, f"test crashed: {outcome}")
+            if verbose:
+                _emit(log)
+            results.append(outcome)
+        
+        # Test 5 runs last so its result isn't skewed by the probes above
+        log = []
+        try:
+            results.append(await test_playwright_ambitionbox(playwright, log, args.pin_dns))
+        finally:
+            if verbose:
+                _emit(log)
+    finally:
+        if playwright:
+            await playwright.stop()
     
-    # Test 3: Specific page
-    results['page'] = test_specific_page()
+    # Exit status for CI: non-zero if any test failed
+    exit_code = 0 if all(r.ok for r in results) else 1
     
-    # Test 4: Playwright basic
-    results['playwright_basic'] = await test_playwright_basic()
+    if not verbose:
+        print(json.dumps({"results": [asdict(r) for r in results]}, ensure_ascii=False, indent=2))
+        return exit_code
     
-    # Test 5: Playwright AmbitionBox
-    working_config = await test_playwright_ambitionbox()
-    results['playwright_ambitionbox'] = working_config is not None
+    passed = {r.name: r.ok for r in results}
+    working_config = results[-1].config
     
-    # Summary
-    print("\n" + "="*60)
-    print("DIAGNOSTIC SUMMARY")
-    print("="*60)
+    # The summary, recommendations and next steps go out as one write
+    report = []
+    report.append("\n" + "="*60)
+    report.append("DIAGNOSTIC SUMMARY")
+    report.append("="*60)
     
-    for test, passed in results.items():
-        status = "✓ PASS" if passed else "✗ FAIL"
-        print(f"{status}: {test}")
+    for r in results:
+        report.append(f"{'✓ PASS' if r.ok else '✗ FAIL'}: {r.name} — {r.detail}")
     
-    print("\n" + "="*60)
-    print("RECOMMENDATIONS")
-    print("="*60)
+    report.append("\n" + "="*60)
+    report.append("RECOMMENDATIONS")
+    report.append("="*60)
     
-    if not results['dns']:
-        print("\n❌ DNS ISSUE:")
-        print("   - Check your internet connection")
-        print("   - Try different DNS (8.8.8.8 or 1.1.1.1)")
-        print("   - Check if AmbitionBox is blocked by firewall/ISP")
+    if not passed['dns']:
+        report.append("\n❌ DNS ISSUE:")
+        report.append("   - Check your internet connection")
+        report.append("   - Try different DNS (8.8.8.8 or 1.1.1.1)")
+        report.append("   - Check if AmbitionBox is blocked by firewall/ISP")
     
-    elif not results['http']:
-        print("\n❌ CONNECTIVITY ISSUE:")
-        print("   - AmbitionBox might be blocking automated requests")
-        print("   - Try using a VPN")
-        print("   - Check corporate firewall settings")
-        print("   - Verify SSL certificates are up to date")
+    elif not passed['http']:
+        report.append("\n❌ CONNECTIVITY ISSUE:")
+        report.append("   - AmbitionBox might be blocking automated requests")
+        report.append("   - Try using a VPN")
+        report.append("   - Check corporate firewall settings")
+        report.append("   - Verify SSL certificates are up to date")
     
-    elif not results['playwright_ambitionbox']:
-        print("\n❌ PLAYWRIGHT ISSUE:")
-        print("   - Requests library works but Playwright doesn't")
-        print("   - This suggests AmbitionBox detects/blocks Playwright")
-        print("\n   Solutions:")
-        print("   1. Use the requests-based scraper (slower but works)")
-        print("   2. Add more human-like behavior (delays, mouse movements)")
-        print("   3. Try from a different network")
-        print("   4. Use residential proxies")
+    elif not passed['playwright_ambitionbox']:
+        report.append("\n❌ PLAYWRIGHT ISSUE:")
+        report.append("   - Plain HTTP requests (httpx) work but Playwright doesn't")
+        report.append("   - This suggests AmbitionBox detects/blocks Playwright")
+        report.append("\n   Solutions:")
+        report.append("   1. Use the requests-based scraper (slower but works)")
+        report.append("   2. Add more human-like behavior (delays, mouse movements)")
+        report.append("   3. Try from a different network")
+        report.append("   4. Use residential proxies")
     
     else:
-        print("\n✅ ALL TESTS PASSED!")
+        report.append("\n✅ ALL TESTS PASSED!")
         if working_config:
-            print(f"\n   Working configuration: {working_config['name']}")
-            print(f"\n   Use this in your scraper:")
-            print(f"   - headless: {working_config['headless']}")
-            print(f"   - args: {working_config['args']}")
+            report.append(f"\n   Working configuration: {working_config['name']}")
+            report.append(f"\n   Use this in your scraper:")
+            report.append(f"   - headless: {working_config['headless']}")
+            report.append(f"   - args: {working_config['args']}")
     
     # Additional suggestions
-    print("\n" + "="*60)
-    print("NEXT STEPS")
-    print("="*60)
+    report.append("\n" + "="*60)
+    report.append("NEXT STEPS")
+    report.append("="*60)
     
-    if results['http'] and not results['playwright_ambitionbox']:
-        print("\n1. Try the requests-based fallback scraper:")
-        print("   python scraper_requests_fallback.py --csv test.csv")
+    if passed['http'] and not passed['playwright_ambitionbox']:
+        report.append("\n1. Try the requests-based fallback scraper:")
+        report.append("   python scraper_requests_fallback.py --csv test.csv")
         
-        print("\n2. Try from a different network:")
-        print("   - Mobile hotspot")
-        print("   - Different WiFi")
-        print("   - VPN")
+        report.append("\n2. Try from a different network:")
+        report.append("   - Mobile hotspot")
+        report.append("   - Different WiFi")
+        report.append("   - VPN")
         
-        print("\n3. Try with visible browser (non-headless):")
-        print("   - Edit scraper: set headless=False")
-        print("   - This helps bypass detection sometimes")
+        report.append("\n3. Try with visible browser (non-headless):")
+        report.append("   - Edit scraper: set headless=False")
+        report.append("   - This helps bypass detection sometimes")
     
-    elif results['playwright_ambitionbox']:
-        print("\n✓ Connection is working!")
-        print("   Run your scraper normally:")
-        print("   python ab_batch_scraper.py --csv test.csv")
+    elif passed['playwright_ambitionbox']:
+        report.append("\n✓ Connection is working!")
+        report.append("   Run your scraper normally:")
+        report.append("   python ab_batch_scraper.py --csv test.csv")
     
-    print("\n" + "="*60)
+    report.append("\n" + "="*60)
+    _emit(report)
+    return exit_code
 
 if __name__ == "__main__":
+    # uvloop has no Windows build; fall back to the default loop there or if
+    # it isn't installed
+    if sys.platform != "win32":
+        try:
+            import uvloop
+            asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+        except ImportError:
+            pass
     try:
-        asyncio.run(main())
+        sys.exit(asyncio.run(main(parse_args())))
     except KeyboardInterrupt:
         print("\n\n⚠ Diagnostic interrupted")
\ No newline at end of file